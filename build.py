@@ -1,15 +1,22 @@
 import argparse
+import concurrent.futures
+import copy
+import functools
 import hashlib
 import io
 import json
 import os
 import pathlib
+import shutil
+import struct
 import sys
 import typing
 import zipfile
 
 import boto3
+import botocore.exceptions
 import requests
+import requests.adapters
 import troposphere.awslambda
 import troposphere.cloudformation
 import troposphere.config
@@ -22,6 +29,21 @@ import troposphere.s3
 import troposphere.sns
 import troposphere.stepfunctions
 
+PACKAGES = ("boto3", "botocore", "urllib3")  #: packages bundled in the code zip
+# Step Functions names are limited to 80 characters, so the stack name can be at most 73 characters. Stacks created
+# before the name was set get their Waiter replaced on their first update, which stops waits running on the old one.
+WAITER_NAME = "${AWS::StackName}-Waiter"  #: state machine name, known up front so the Lambda can get its ARN
+
+# shared between download threads so connections to PyPI are reused
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=len(PACKAGES), pool_maxsize=len(PACKAGES)))
+
+
+def waiter_arn() -> troposphere.Sub:
+    return troposphere.Sub(
+        f"arn:${{AWS::Partition}}:states:${{AWS::Region}}:${{AWS::AccountId}}:stateMachine:{WAITER_NAME}"
+    )
+
 
 def add_lambda_role(template: troposphere.Template) -> troposphere.iam.Role:
     role = troposphere.iam.Role(
@@ -45,27 +67,28 @@ def add_lambda_role(template: troposphere.Template) -> troposphere.iam.Role:
         ManagedPolicyArns=["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"],
         Policies=[
             troposphere.iam.Policy(
-                PolicyName="GetWaiterARN",
+                PolicyName="CustomAPIs",
                 PolicyDocument={
                     "Version": "2012-10-17",
                     "Statement": [
                         {
                             "Effect": "Allow",
-                            "Action": "cloudformation:DescribeStackResource",
-                            "Resource": troposphere.StackId,
+                            "Action": list(_get_iam_actions()),
+                            "Resource": "*",
                         },
                     ]
                 }
             ),
             troposphere.iam.Policy(
-                PolicyName="CustomAPIs",
+                PolicyName="CallWaiter",
                 PolicyDocument={
                     "Version": "2012-10-17",
                     "Statement": [
                         {
                             "Effect": "Allow",
-                            "Action": list(_get_iam_actions()),
-                            "Resource": "*",
+                            "Action": "states:StartExecution",
+                            # Ref to Waiter here would be a circular dependency as Waiter depends on the function
+                            "Resource": waiter_arn(),
                         },
                     ]
                 }
@@ -73,22 +96,6 @@ def add_lambda_role(template: troposphere.Template) -> troposphere.iam.Role:
         ]
     )
 
-    troposphere.iam.PolicyType(
-        "CallWaiterPolicy", template,
-        Roles=[role.ref()],
-        PolicyName="CallWaiter",
-        PolicyDocument={
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Action": "states:StartExecution",
-                    "Resource": troposphere.Ref("Waiter"),
-                },
-            ]
-        }
-    )
-
     return role
 
 
@@ -149,6 +156,7 @@ def add_state_machine(template, function: troposphere.awslambda.Function):
 
     state_machine = troposphere.stepfunctions.StateMachine(
         "Waiter", template,
+        StateMachineName=troposphere.Sub(WAITER_NAME),
         DefinitionString=troposphere.Sub(
             json.dumps({
                 "StartAt": "Wait",
@@ -164,7 +172,7 @@ def add_state_machine(template, function: troposphere.awslambda.Function):
                         "End": True,
                     },
                 }
-            })),
+            }, separators=(",", ":"))),
         RoleArn=add_state_machine_role(template, function).get_att("Arn"),
     )
 
@@ -180,68 +188,115 @@ def get_package_zip(package: str) -> zipfile.ZipFile:
     if package_cache_path.is_file():
         return zipfile.ZipFile(package_cache_path.open("rb"))
 
-    for u in requests.get(f"https://pypi.org/pypi/{package}/json").json()["urls"]:
+    for u in _http.get(f"https://pypi.org/pypi/{package}/json").json()["urls"]:
         if u["packagetype"] == "bdist_wheel":
-            content = requests.get(u["url"]).content
-            package_cache_path.write_bytes(content)
-            return zipfile.ZipFile(io.BytesIO(content))
+            # stream straight to the cache and read it back from disk instead of keeping the whole wheel in memory
+            download_path = package_cache_path.with_suffix(".part")
+            with _http.get(u["url"], stream=True) as response, download_path.open("wb") as f:
+                response.raise_for_status()
+                for chunk in response.iter_content(1 << 20):
+                    f.write(chunk)
+            download_path.replace(package_cache_path)
+            return zipfile.ZipFile(package_cache_path.open("rb"))
 
     raise RuntimeError(f"Unable to get {package}")
 
 
-def add_package_to_zip(zip_file: zipfile.ZipFile, package: str):
-    package_zip = get_package_zip(package)
-
-    for f in package_zip.infolist():
-        zip_file.writestr(f, package_zip.read(f), zipfile.ZIP_DEFLATED)
+def _read_raw_member(package_zip: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    package_zip.fp.seek(info.header_offset)
+    header = package_zip.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    package_zip.fp.seek(name_length + extra_length, os.SEEK_CUR)
+    return package_zip.fp.read(info.compress_size)
 
 
-def gen_zip() -> bytes:
+def add_package_to_zip(zip_file: zipfile.ZipFile, package_zip: zipfile.ZipFile):
+    # wheels are already compressed, so copy the compressed bytes as-is instead of inflating and deflating them again
+    for f in package_zip.infolist():
+        data = _read_raw_member(package_zip, f)
+
+        zi = copy.copy(f)
+        zi.flag_bits &= ~0x08  # sizes and CRC go in the local header, so no data descriptor follows the data
+        zip_file.fp.seek(zip_file.start_dir)
+        zi.header_offset = zip_file.start_dir
+        zip_file.fp.write(zi.FileHeader())
+        zip_file.fp.write(data)
+        zip_file.start_dir = zip_file.fp.tell()
+        zip_file.filelist.append(zi)
+        zip_file.NameToInfo[zi.filename] = zi
+        zip_file._didModify = True
+
+
+def _source_files(path: str) -> typing.Iterator[str]:
+    with os.scandir(path) as it:
+        for entry in sorted(it, key=lambda e: e.name):
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != "__pycache__":
+                    yield from _source_files(entry.path)
+            elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".pyc"):
+                yield entry.path
+
+
+def _add_sources_to_zip(new_zip: zipfile.ZipFile, compress_type: int):
+    for path in _source_files("cfmreslib"):
+        zi = zipfile.ZipInfo(os.path.relpath(path, "."))
+        zi.external_attr = 0o644 << 16
+        zi.compress_type = compress_type
+        # stream into the zip instead of reading whole files, but keep our own ZipInfo (and its fixed timestamp) so
+        # the zip hash stays stable between builds
+        with open(path, "rb") as src, new_zip.open(zi, "w") as dst:
+            shutil.copyfileobj(src, dst)
+
+
+def gen_zip(compress_type: int = zipfile.ZIP_DEFLATED) -> typing.Tuple[bytes, str]:
     new_zip_file = io.BytesIO()
-    new_zip = zipfile.ZipFile(new_zip_file, "w")
-
-    for root, dirs, files in os.walk("cfmreslib"):
-        if "__pycache__" in root:
-            continue
-
-        for f in files:
-            if f.endswith(".pyc"):
-                continue
-
-            path = os.path.join(root, f)
-            zip_path = os.path.relpath(path, ".")
-            zi = zipfile.ZipInfo(zip_path)
-            zi.external_attr = 0o644 << 16
-            new_zip.writestr(zi, open(path).read(), zipfile.ZIP_DEFLATED)
-
-    add_package_to_zip(new_zip, "boto3")
-    add_package_to_zip(new_zip, "botocore")
-    add_package_to_zip(new_zip, "urllib3")
+    # zipfile does many small writes, so coalesce them before they hit the BytesIO
+    buffered_zip_file = io.BufferedWriter(new_zip_file, buffer_size=1 << 20)
+    new_zip = zipfile.ZipFile(buffered_zip_file, "w")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(PACKAGES)) as executor:
+        # download wheels while sources are being zipped
+        package_zips = [executor.submit(get_package_zip, p) for p in PACKAGES]
+        _add_sources_to_zip(new_zip, compress_type)
+        # add in a fixed order so the zip hash doesn't depend on which download finished first
+        for package_zip in package_zips:
+            add_package_to_zip(new_zip, package_zip.result())
 
     new_zip.close()
-    new_zip_file.seek(0)
+    buffered_zip_file.flush()
+
+    # hash the buffer in place instead of copying it out first
+    zip_hash = hashlib.sha1(new_zip_file.getbuffer()).hexdigest()
 
-    return new_zip_file.read()
+    return new_zip_file.getvalue(), zip_hash
 
 
-def _get_iam_actions() -> typing.List[str]:
+@functools.lru_cache(maxsize=1)
+def _get_iam_actions() -> typing.Tuple[str, ...]:
     import cfmreslib.reslib
-    for res in cfmreslib.resources.ALL_RESOURCES:
-        yield from res().get_iam_actions()
+    # dict keeps the first occurrence order while dropping actions shared by multiple resources
+    return tuple(dict.fromkeys(
+        action
+        for res in cfmreslib.resources.ALL_RESOURCES.values()
+        for action in res().get_iam_actions()
+    ))
 
 
-def _upload_template(bucket: str, tag: str):
+def _upload_template(bucket: str, tag: str, compress_type: int):
     template = troposphere.Template("CloudFormation resource library (cfm-reslib)")
 
     # TODO auto generate documentation
     print("Building zip...")
-    zip_data = gen_zip()
-    zip_hash = hashlib.new("sha1", zip_data).hexdigest()
+    zip_data, zip_hash = gen_zip(compress_type)
     zip_name = f"{zip_hash}.zip"
     print("Uploading code zip...")
     s3 = boto3.client("s3")
-    if "Contents" not in s3.list_objects(Bucket=bucket, Prefix=zip_name):
-        s3.put_object(Bucket=bucket, Key=zip_name, Body=gen_zip())
+    try:
+        s3.head_object(Bucket=bucket, Key=zip_name)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "404":
+            raise
+        s3.put_object(Bucket=bucket, Key=zip_name, Body=zip_data)
     print("Done")
 
     print("Generating template...")
@@ -249,7 +304,8 @@ def _upload_template(bucket: str, tag: str):
     add_state_machine(template, function)
     function.Environment = troposphere.awslambda.Environment(
         Variables={
-            "THIS_STACK": troposphere.StackId,
+            # referencing Waiter directly would create a circular dependency, so build the ARN from its name instead
+            "WAITER_ARN": waiter_arn(),
         }
     )
 
@@ -273,10 +329,12 @@ def main(argv):
                         help="S3 bucket where artifacts will be copied")
     parser.add_argument("-t", "--tag", default="latest",
                         help="Set template name to cfm-reslib-<TAG>.template")
+    parser.add_argument("--store", action="store_true",
+                        help="Store cfmreslib sources in the zip without compression (bundled wheels are copied as-is)")
 
     args = parser.parse_args(argv)
 
-    _upload_template(args.bucket, args.tag)
+    _upload_template(args.bucket, args.tag, zipfile.ZIP_STORED if args.store else zipfile.ZIP_DEFLATED)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 import re
@@ -5,7 +6,8 @@ import traceback
 from typing import Optional, Dict, List
 
 import boto3
-from botocore.vendored import requests
+import botocore.config
+import urllib3
 
 from cfmreslib import docs
 from cfmreslib.docs import shape_args_to_doc
@@ -14,6 +16,22 @@ SUCCESS = "SUCCESS"
 FAILED = "FAILED"
 UNABLE_TO_CREATE = "XXXX_UNABLE_TO_CREATE_XXXX"
 AWS_SESSION = boto3.Session(region_name="us-east-1")
+# clients keep their HTTP connections pooled, standard retries just add better backoff for throttling
+_CLIENT_CONFIG = botocore.config.Config(retries={"mode": "standard"})
+# kept for the life of the process so warm invocations can reuse the connection for their responses
+_HTTP = urllib3.PoolManager(retries=urllib3.util.Retry(total=3, backoff_factor=0.2))
+# event fields passed on to wait requests, everything else is dropped to keep the Step Functions input small
+_WAIT_EVENT_KEYS = ("ResponseURL", "StackId", "RequestId", "LogicalResourceId", "ResourceType", "ResourceProperties",
+                    "OldResourceProperties")
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service: str, config: botocore.config.Config = _CLIENT_CONFIG):
+    """
+    Returns a boto3 client for the given service. Clients are created once per service and config and shared for the
+    life of the process.
+    """
+    return AWS_SESSION.client(service, config=config)
 
 
 def send_cf_response(event, context, response_status, response_data, physical_resource_id, reason=None):
@@ -37,20 +55,22 @@ def send_cf_response(event, context, response_status, response_data, physical_re
     }
 
     print("Responding to CloudFormation with", response)
-    cf_response = requests.put(response_url, json=response, headers={"content-type": ""})
-    print("CloudFormation result:", cf_response.reason, cf_response.text)
+    cf_response = _HTTP.request(
+        "PUT",
+        response_url,
+        body=json.dumps(response, separators=(",", ":"), ensure_ascii=False).encode(),
+        headers={"content-type": ""},
+    )
+    print("CloudFormation result:", cf_response.reason, cf_response.data.decode())
 
 
-def _diff_attributes(old_props, new_props):
-    old_attrs = set(old_props.keys())
-    new_attrs = set(new_props.keys())
+_MISSING = object()
 
-    # attributes only in old or only in new
-    yield from old_attrs.symmetric_difference(new_attrs)
 
-    # attributes that changed value
-    for k in old_attrs.intersection(new_attrs):
-        if old_props[k] != new_props[k]:
+def _diff_attributes(old_props, new_props):
+    # attributes only in old or only in new compare against the sentinel, so they're always yielded
+    for k in old_props.keys() | new_props.keys():
+        if old_props.get(k, _MISSING) != new_props.get(k, _MISSING):
             yield k
 
 
@@ -60,6 +80,19 @@ def _clean_properties(props):
     return args
 
 
+@functools.lru_cache(maxsize=None)
+def _get_yaml():
+    import yaml  # don't import in lambda
+
+    # https://github.com/yaml/pyyaml/issues/98
+    def quoted_presenter(dumper, data):
+        style = '"' if re.match("^[0-9]+$", data) else ''
+        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style=style)
+
+    yaml.add_representer(str, quoted_presenter)
+    return yaml
+
+
 class CustomResourceHandler(object):
     """
     Abstract base class for all custom resources. Implement this class for new resources. Check the documentation for
@@ -86,22 +119,9 @@ class CustomResourceHandler(object):
         self.physical_id = event.get("PhysicalResourceId", UNABLE_TO_CREATE)
 
         try:
-            if event["RequestType"] == "WaitReady":
-                if self.ready():
-                    self._success(self.data())
-                else:
-                    self._wait_ready()
-            elif event["RequestType"] == "WaitDelete":
-                if not self.__exists():
-                    self._success({})
-                else:
-                    self._wait_delete()
-            elif event["RequestType"] == "Create":
-                self.__handle_create()
-            elif event["RequestType"] == "Update":
-                self.__handle_update()
-            elif event["RequestType"] == "Delete":
-                self.__handle_delete()
+            request_handler = self._REQUEST_HANDLERS.get(event["RequestType"])
+            if request_handler:
+                request_handler(self)
             else:
                 self._fail(f"Invalid request type {event['RequestType']}")
 
@@ -129,7 +149,7 @@ class CustomResourceHandler(object):
         diff = list(_diff_attributes(old_arguments, new_arguments))
         print("Attributes diff:", diff)
 
-        if self.can_update(old_arguments, new_arguments, diff):
+        if not self.can_update(old_arguments, new_arguments, diff):
             print("Recreating resource because modified attributes can't be updated")
             return self.__handle_create()
 
@@ -142,34 +162,54 @@ class CustomResourceHandler(object):
 
         self.delete()
 
+    def __handle_wait_ready(self):
+        if self.ready():
+            self._success(self.data())
+        else:
+            self._wait_ready()
+
+    def __handle_wait_delete(self):
+        if not self.__exists():
+            self._success({})
+        else:
+            self._wait_delete()
+
+    _REQUEST_HANDLERS = {
+        "Create": __handle_create,
+        "Update": __handle_update,
+        "Delete": __handle_delete,
+        "WaitReady": __handle_wait_ready,
+        "WaitDelete": __handle_wait_delete,
+    }
+
     def _success(self, data):
         send_cf_response(self.event, self.context, SUCCESS, data, self.physical_id)
 
     def _fail(self, reason):
         send_cf_response(self.event, self.context, FAILED, {}, self.physical_id, reason=reason)
 
-    def __wait(self, wait_action):
+    def _wait(self, wait_action):
+        """
+        Starts the waiter state machine, which calls the handler again with `wait_action` as the request type after a
+        while. Subclasses handling their own request types should add them to `_REQUEST_HANDLERS`.
+        """
         # TODO limit repeats -- if cloudformation gave up, give up?
-        event_copy = self.event.copy()
-        event_copy["RequestType"] = wait_action
-        event_copy["PhysicalResourceId"] = self.physical_id
+        wait_event = {k: self.event[k] for k in _WAIT_EVENT_KEYS if k in self.event}
+        wait_event["RequestType"] = wait_action
+        wait_event["PhysicalResourceId"] = self.physical_id
 
-        waiter_resource = AWS_SESSION.client("cloudformation").describe_stack_resource(
-            StackName=os.getenv("THIS_STACK"),
-            LogicalResourceId="Waiter",
-        )
-        AWS_SESSION.client("stepfunctions").start_execution(
-            stateMachineArn=waiter_resource["StackResourceDetail"]["PhysicalResourceId"],
-            input=json.dumps(event_copy),
+        get_client("stepfunctions").start_execution(
+            stateMachineArn=os.environ["WAITER_ARN"],
+            input=json.dumps(wait_event, separators=(",", ":")),
         )
 
     def _wait_ready(self):
         print("Resource not ready yet, waiting...")
-        self.__wait("WaitReady")
+        self._wait("WaitReady")
 
     def _wait_delete(self):
         print("Resource not deleted yet, waiting...")
-        self.__wait("WaitDelete")
+        self._wait("WaitDelete")
 
     # to be implemented by subclasses
 
@@ -261,20 +301,12 @@ class CustomResourceHandler(object):
 
     @classmethod
     def write_docs(cls, doc: docs.DocWriter):
-        import yaml  # don't import in lambda
-
-        # https://github.com/yaml/pyyaml/issues/98
-        def quoted_presenter(dumper, data):
-            style = '"' if re.match("^[0-9]+$", data) else ''
-            return dumper.represent_scalar('tag:yaml.org,2002:str', data, style=style)
-
-        yaml.add_representer(str, quoted_presenter)
-
         doc.add_header(f"Custom::{cls.NAME}", "=")
         doc.add_paragraph(cls.DESCRIPTION)
         instance = cls()
         shape_args_to_doc(doc, f"Custom::{cls.NAME}", instance.input_shape, instance.REPLACEMENT_REQUIRED_ATTRIBUTES)
         if cls.EXAMPLES:
+            yaml = _get_yaml()
             doc.add_header("Examples", "*")
             for e in cls.EXAMPLES:
                 doc.add_header(e["title"], "~")
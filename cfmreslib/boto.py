@@ -1,15 +1,42 @@
-import collections
+import concurrent.futures
+import functools
+import operator
 from typing import Dict, List, Optional
 
 from botocore.utils import CachedProperty
 
-from cfmreslib.base import AWS_SESSION, CustomResourceHandler
+from cfmreslib.base import CustomResourceHandler, get_client
 
 
-def _select(data, query):
-    for q in query.split("."):
-        data = data[q]
-    return data
+@functools.lru_cache(maxsize=None)
+def _api_name(service, method_name):
+    return get_client(service).meta.method_to_api_mapping[method_name]
+
+
+@functools.lru_cache(maxsize=None)
+def _operation_model(service, method_name):
+    return get_client(service).meta.service_model.operation_model(_api_name(service, method_name))
+
+
+def _build_type_map(shape, path=(), parents=()):
+    parents = parents + (shape.name,)  # guards against recursive shapes
+    for name, member in shape.members.items():
+        member_path = path + (name,)
+        yield member_path, member.type_name
+        if member.type_name == "structure" and member.name not in parents:
+            yield from _build_type_map(member, member_path, parents)
+
+
+# argument types CloudFormation passes as strings that botocore won't accept as-is
+_COERCED_TYPES = {"integer", "boolean"}
+
+
+def _split_query(query):
+    return tuple(query.split(".")) if query else None
+
+
+def _select(data, path):
+    return functools.reduce(operator.getitem, path, data)
 
 
 class BotoMethod(object):
@@ -19,55 +46,59 @@ class BotoMethod(object):
         self.physical_id_argument = method_desc.get("physical_id_argument")
         self.attributes_query = method_desc.get("attributes_query")
         self.physical_id_query = method_desc.get("physical_id_query")
-        self._client = AWS_SESSION.client(service)
+        # queries are split once here as they're used on every call
+        self.attributes_path = _split_query(self.attributes_query)
+        self.physical_id_path = _split_query(self.physical_id_query)
+        self._client = get_client(service)
         self._method = getattr(self._client, self.method_name)
+        # resolved here so service model errors show up when the method is defined and not in the middle of a request
+        self.input_shape = _operation_model(service, self.method_name).input_shape
+        self.method_input = self.input_shape.members
+        self.iam_op = f"{service}:{_api_name(service, self.method_name)}"
 
     @CachedProperty
-    def method_input(self):
-        return self.input_shape.members
-
-    @CachedProperty
-    def input_shape(self):
-        op = self._client.meta.method_to_api_mapping[self.method_name]
-        return self._client.meta.service_model.operation_model(op).input_shape
+    def _type_map(self):
+        # flattened argument path -> type name, so coercion doesn't walk the shape for every argument
+        return dict(_build_type_map(self.input_shape))
 
     @CachedProperty
-    def iam_op(self):
-        op = self._client.meta.method_to_api_mapping[self.method_name]
-        return f"{self.service}:{op}"
+    def _needs_coercion(self):
+        # most methods have no integer or boolean arguments and can take the CloudFormation arguments as they are
+        return not _COERCED_TYPES.isdisjoint(self._type_map.values())
 
-    def _coerce_args(self, kwargs, path=[]):
+    def _coerce_args(self, kwargs, path=()):
         for k, v in kwargs.items():
-            if self._get_arg_type(path, k) == "integer":
+            arg_type = self._get_arg_type(path, k)
+            # type() and not isinstance() so booleans still go through int()
+            if arg_type == "integer" and type(v) is not int:
                 try:
                     yield k, int(v)
                 except ValueError:
                     yield k, v  # user will get an error saying an integer is expected when executing the method
+            elif arg_type == "boolean" and isinstance(v, str) and v.lower() in ("true", "false"):
+                # CloudFormation sends booleans as strings and bool("false") is True
+                yield k, v.lower() == "true"
             elif isinstance(v, dict):
-                yield k, dict(self._coerce_args(v, path + [k]))
+                yield k, dict(self._coerce_args(v, path + (k,)))
             else:
                 yield k, v
 
     def _get_arg_type(self, path, name):
-        try:
-            members = self.method_input
-            for p in path:
-                members = members[p].members
-            return members[name].type_name
-        except KeyError:
-            print("Unable to find input arg type for", self, path, name)
-            return ""
+        # unknown arguments are left alone, botocore's parameter validation will report them
+        return self._type_map.get((*path, name), "")
 
     def __call__(self, **kwargs):
-        coerced_kwargs = dict(self._coerce_args(kwargs))
+        coerced_kwargs = dict(self._coerce_args(kwargs)) if self._needs_coercion else kwargs
         print("Calling", self, coerced_kwargs)
         return self._method(**coerced_kwargs)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash((self.service, self.method_name))
 
     def __eq__(self, other):
-        return isinstance(other, BotoMethod) and self.service == other.service and self.method_name == other.method_name
+        return self is other or (
+            isinstance(other, BotoMethod) and self.service == other.service and self.method_name == other.method_name
+        )
 
     def __str__(self):
         return f"{self.service}.{self.method_name}"
@@ -92,6 +123,11 @@ class BotoResourceHandler(CustomResourceHandler):
     #: the exists method result, "expected_value" with the expected value (e.g. READY), and "failed_values" with values
     #: that denote failure and should stop the operation.
     EXIST_READY_QUERY = {}
+    #: Optional descriptor of query to check against the result of ``CREATE_METHOD`` when it already returns the
+    #: resource state. When set, a newly created resource is checked without calling ``EXISTS_METHOD`` again. Requires
+    #: "query" with the query to run over the create method result. Expected and failed values are taken from
+    #: ``EXIST_READY_QUERY``.
+    CREATE_READY_QUERY = {}
     #: Descriptor for method used to delete an existing resource. Requires "name" with the name of the method, and
     #: "physical_id_argument" with the name of the method argument that needs to have the physical id of the resource.
     DELETE_METHOD = {}
@@ -106,77 +142,95 @@ class BotoResourceHandler(CustomResourceHandler):
     def __init__(self):
         super().__init__()
 
-        self._CLIENT = AWS_SESSION.client(self.SERVICE)
+        self._init_class()
+        self._data = None
+        self._description = None
+
+    @classmethod
+    def _init_class(cls):
+        # everything here only depends on class constants, so it's built once per class and not for every request
+        if cls.__dict__.get("_class_initialized"):
+            return
+
+        cls._create_method = BotoMethod(cls.SERVICE, cls.CREATE_METHOD)
+        cls._update_methods = [BotoMethod(cls.SERVICE, m) for m in cls.UPDATE_METHODS]
+        cls._exists_method = BotoMethod(cls.SERVICE, cls.EXISTS_METHOD)
+        cls._delete_method = BotoMethod(cls.SERVICE, cls.DELETE_METHOD)
+        cls._ready_query_path = _split_query(cls.EXIST_READY_QUERY.get("query"))
+        cls._create_ready_query_path = _split_query(cls.CREATE_READY_QUERY.get("query"))
+        cls._not_found_exception = getattr(get_client(cls.SERVICE).exceptions, cls.NOT_FOUND_EXCEPTION)
+
+        cls.UPDATE_ATTRIBUTE_METHOD_MAP = {
+            attr: update_method for update_method in cls._update_methods for attr in update_method.method_input.keys()
+        }
+        cls.REPLACEMENT_REQUIRED_ATTRIBUTES = set(cls._create_method.method_input.keys()).difference(
+            cls.UPDATE_ATTRIBUTE_METHOD_MAP
+        )
 
-        create_input = self._create_method.method_input
+        cls._iam_actions = tuple(
+            method.iam_op
+            for method in [cls._create_method, cls._exists_method, cls._delete_method] + cls._update_methods
+        ) + tuple(cls.EXTRA_PERMISSIONS)
 
-        self.REPLACEMENT_REQUIRED_ATTRIBUTES = set(create_input.keys())
-        for update_method in self._update_methods:
-            for attr in update_method.method_input.keys():
-                self.REPLACEMENT_REQUIRED_ATTRIBUTES.discard(attr)
-                self.UPDATE_ATTRIBUTE_METHOD_MAP[attr] = update_method
-
-        self._data = None
+        cls._class_initialized = True
 
     @property
     def input_shape(self):
         return self._create_method.input_shape
 
-    @CachedProperty
-    def _create_method(self):
-        return BotoMethod(self.SERVICE, self.CREATE_METHOD)
-
-    @CachedProperty
-    def _update_methods(self):
-        return [BotoMethod(self.SERVICE, m) for m in self.UPDATE_METHODS]
-
-    @CachedProperty
-    def _exists_method(self):
-        return BotoMethod(self.SERVICE, self.EXISTS_METHOD)
-
-    @CachedProperty
-    def _delete_method(self):
-        return BotoMethod(self.SERVICE, self.DELETE_METHOD)
-
-    def _get_method_input(self, method_name):
-        op = self._CLIENT.meta.method_to_api_mapping[method_name]
-        return self._CLIENT.meta.service_model.operation_model(op).input_shape.members
-
     def create(self, args: Dict[str, object]) -> None:
         response = self._create_method(**args)
-        self.physical_id = _select(response, self._create_method.physical_id_query)
+        self._description = None
+        self.physical_id = _select(response, self._create_method.physical_id_path)
         data = None
-        if self._create_method.attributes_query:
-            data = _select(response, self._create_method.attributes_query)
+        if self._create_method.attributes_path:
+            data = _select(response, self._create_method.attributes_path)
 
-        if self.ready():
+        if self.EXIST_READY_QUERY and self._create_ready_query_path:
+            ready = self._is_ready_state(_select(response, self._create_ready_query_path))
+        else:
+            ready = self.ready()
+
+        if ready:
             self._success(data)
         else:
             self._wait_ready()
 
     def can_update(self, old_args: Dict[str, object], new_args: Dict[str, object], diff: List[str]) -> bool:
-        return all(attr not in self.REPLACEMENT_REQUIRED_ATTRIBUTES for attr in diff)
+        return self.REPLACEMENT_REQUIRED_ATTRIBUTES.isdisjoint(diff)
 
     def update(self, old_args: Dict[str, object], new_args: Dict[str, object], diff: List[str]) -> None:
-        ops: Dict[BotoMethod, Dict[str, object]] = collections.defaultdict(dict)
+        ops: Dict[BotoMethod, Dict[str, object]] = {}
         for attr in diff:
             try:
                 update_method = self.UPDATE_ATTRIBUTE_METHOD_MAP[attr]
-                ops[update_method][update_method.physical_id_argument] = self.physical_id
-                # we need .get(attr, "") here so we reset attributes that are being removed
-                # for example ETS pipeline that had AwsKmsKeyArn and now doesn't
-                # using None doesn't work as AWS validates the attribute type
-                ops[update_method][attr] = self.event["ResourceProperties"].get(attr, "")
             except KeyError:
                 return self._fail(f"Invalid attribute: {attr}")
 
+            update_arguments = ops.setdefault(update_method, {update_method.physical_id_argument: self.physical_id})
+            # we need .get(attr, "") here so we reset attributes that are being removed
+            # for example ETS pipeline that had AwsKmsKeyArn and now doesn't
+            # using None doesn't work as AWS validates the attribute type
+            update_arguments[attr] = self.event["ResourceProperties"].get(attr, "")
+
         if not ops:
             return self._fail("Unable to find any update operations to execute")
 
+        # each update method is a separate API call, so run them concurrently (boto3 clients are thread safe)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ops)) as executor:
+            responses = [
+                (update_method, executor.submit(update_method, **update_arguments))
+                for update_method, update_arguments in ops.items()
+            ]
+
+        self._description = None
         data = {}
-        for update_method, update_arguments in ops.items():
-            response = update_method(**update_arguments)
-            data = _select(response, update_method.attributes_query)
+        # raises the first failed update, which handle() reports back to CloudFormation
+        for update_method, response in responses:
+            response = response.result()
+            if update_method.attributes_path:
+                # merged so attributes returned by one update method aren't lost to the next one
+                data.update(_select(response, update_method.attributes_path))
 
         self._success(data)
 
@@ -185,6 +239,7 @@ class BotoResourceHandler(CustomResourceHandler):
             self._delete_method.physical_id_argument: self.physical_id
         }
         self._delete_method(**args)
+        self._description = None
         if not self.exists():
             self._success(None)
         else:
@@ -193,46 +248,44 @@ class BotoResourceHandler(CustomResourceHandler):
     def data(self) -> Optional[Dict[str, object]]:
         return self._data
 
-    def exists(self) -> bool:
-        try:
+    def _describe(self):
+        # exists() and ready() need the same call, so its response is kept until the resource is modified
+        if self._description is None or self._description[0] != self.physical_id:
             args = {
                 self._exists_method.physical_id_argument: self.physical_id
             }
             response = self._exists_method(**args)
-            if self._exists_method.attributes_query:
-                self._data = _select(response, self._exists_method.attributes_query)
+            if self._exists_method.attributes_path:
+                self._data = _select(response, self._exists_method.attributes_path)
+            self._description = (self.physical_id, response)
+
+        return self._description[1]
+
+    def exists(self) -> bool:
+        try:
+            self._describe()
             return True
-        except getattr(self._CLIENT.exceptions, self.NOT_FOUND_EXCEPTION):
+        except self._not_found_exception:
             return False
 
     def ready(self) -> bool:
         if not self.EXIST_READY_QUERY:
             return True
 
-        query = self.EXIST_READY_QUERY["query"]
+        return self._is_ready_state(_select(self._describe(), self._ready_query_path))
+
+    def _is_ready_state(self, value) -> bool:
         expected_value = self.EXIST_READY_QUERY["expected_value"]
         failed_values = self.EXIST_READY_QUERY["failed_values"]
 
-        args = {
-            self._exists_method.physical_id_argument: self.physical_id
-        }
-        data = self._exists_method(**args)
-        value = _select(data, query)
-
-        print(f"Resource state is {value}")
-
         if value == expected_value:
-            print("Ready")
+            print(f"Resource state is {value}, ready")
             return True
         if value in failed_values:
-            print("Failed")
             raise RuntimeError(f"Invalid resource state {value}")
 
-        print("Not ready")
+        print(f"Resource state is {value}, not ready")
         return False
 
     def get_iam_actions(self):
-        for method in [self._create_method, self._exists_method, self._delete_method] + self._update_methods:
-            yield method.iam_op
-
-        yield from self.EXTRA_PERMISSIONS
+        return self._iam_actions
@@ -18,7 +18,7 @@ class DocWriter(object):
         self.name = name
         self.path = os.path.join(base_path, f"{self.name}.rst")
         assert not os.path.isfile(self.path), self.path
-        self.doc = ""
+        self.doc = []
         self.literals = {}
         self.toc = []
 
@@ -27,17 +27,21 @@ class DocWriter(object):
         return DocWriter(self.base_path, name)
 
     def add_header(self, text, underline):
-        self.doc += f"{text}\n{underline * len(text)}\n\n"
+        self.doc.append(f"{text}\n{underline * len(text)}\n\n")
 
     def add_anchor(self, aid):
-        self.doc += f".. _{aid}:\n\n"
+        self.doc.append(f".. _{aid}:\n\n")
         return f":ref:`{aid}`"
 
     def get_anchor(self, aid):
         return f":ref:`{aid}`"
 
     def add_paragraph(self, text, indent=""):
-        self.doc += textwrap.indent(text + "\n\n", indent)
+        if not indent:
+            # indenting with an empty prefix changes nothing, don't walk the lines for it
+            self.doc.append(text + "\n\n")
+        else:
+            self.doc.append(textwrap.indent(text + "\n\n", indent))
 
     def add_literal(self, name, text):
         self.literals[name] = text
@@ -48,22 +52,24 @@ class DocWriter(object):
         self.add_paragraph(f"|{lid}|", indent)
 
     def add_code(self, language, code):
-        self.doc += f".. code-block:: {language}\n\n"
+        self.doc.append(f".. code-block:: {language}\n\n")
         self.add_paragraph(code, "    ")
 
     def add_parsed_code(self, language, code):
-        self.doc += f".. parsed-literal::\n\n"
+        self.doc.append(f".. parsed-literal::\n\n")
         self.add_paragraph(code, "    ")
 
     def add_toc_item(self, item):
         self.toc.append(item)
 
     def write(self):
-        with open(self.path, "w") as f:
-            f.write(self.doc)
+        # write the chunks as they are instead of joining them into one big string first
+        with open(self.path, "w", buffering=1 << 20) as f:
+            f.writelines(self.doc)
             for name, text in self.literals.items():
                 f.write(f".. |{name}| raw:: html\n\n")
-                f.write(textwrap.indent(text, "    "))
+                # same as textwrap.indent, whitespace-only lines are left alone
+                f.writelines("    " + line if line.strip() else line for line in text.splitlines(True))
                 f.write("\n\n")
             if self.toc:
                 f.write(".. toctree::\n   :hidden:\n\n")
@@ -83,18 +89,18 @@ def shape_args_to_doc(doc: DocWriter, resource_type: str, input_shape, replaceme
 
 
 def _shape_args_to_doc(doc: DocWriter, replacement_attributes, shape, resource_type, history: Set[str]):
-    assert shape.type_name == "structure"
+    members = _classify_members(shape)
 
     doc.add_header("Syntax", "*")
 
     doc.add_header("JSON", "~")
-    doc.add_parsed_code("json", shape_args_to_json(shape, resource_type))
+    doc.add_parsed_code("json", shape_args_to_json(shape, resource_type, members))
     doc.add_header("YAML", "~")
-    doc.add_parsed_code("yaml", shape_args_to_yaml(shape, resource_type))
+    doc.add_parsed_code("yaml", shape_args_to_yaml(shape, resource_type, members))
 
     doc.add_header("Properties", "*")
 
-    for member_name, member_shape in shape.members.items():
+    for member_name, member_shape, element_shape, is_list in members:
         doc.add_anchor(f"member_{shape.name}_{member_name}")
         doc.add_header(member_name, "~")
         doc.add_unnamed_literal(member_shape.documentation, "  ")
@@ -102,28 +108,18 @@ def _shape_args_to_doc(doc: DocWriter, replacement_attributes, shape, resource_t
         required = "Yes" if shape.required_members else "No"
         doc.add_paragraph(f"""*Required*: {required}""", "  ")
 
-        type_name = member_shape.type_name
+        type_name = element_shape.type_name
         if type_name == "structure":
-            if member_shape.name in history:
-                type_name = doc.get_anchor(f"type_{member_shape.name}")
+            if element_shape.name in history:
+                type_name = doc.get_anchor(f"type_{element_shape.name}")
             else:
-                with doc.sub_writer(f"type_{member_shape.name}") as sub_doc:
-                    type_name = sub_doc.add_anchor(f"type_{member_shape.name}")
-                    sub_doc.add_header(member_shape.name, "=")
-                    _shape_args_to_doc(sub_doc, [], member_shape, None, history)
-                history.add(member_shape.name)
-        if type_name == "list":
-            if member_shape.member.type_name == "structure":
-                if member_shape.member.name in history:
-                    type_name = doc.get_anchor(f"type_{member_shape.member.name}")
-                else:
-                    with doc.sub_writer(f"type_{member_shape.member.name}") as sub_doc:
-                        type_name = sub_doc.add_anchor(f"type_{member_shape.member.name}")
-                        sub_doc.add_header(member_shape.member.name, "=")
-                        _shape_args_to_doc(sub_doc, [], member_shape.member, None, history)
-                    history.add(member_shape.member.name)
-            else:
-                type_name = member_shape.member.type_name
+                # added before recursing so recursive shapes link back to the page being written instead of looping
+                history.add(element_shape.name)
+                with doc.sub_writer(f"type_{element_shape.name}") as sub_doc:
+                    type_name = sub_doc.add_anchor(f"type_{element_shape.name}")
+                    sub_doc.add_header(element_shape.name, "=")
+                    _shape_args_to_doc(sub_doc, [], element_shape, None, history)
+        if is_list:
             type_name = "List of " + type_name
         doc.add_paragraph(f"""*Type*: {type_name}""", "  ")
 
@@ -131,7 +127,7 @@ def _shape_args_to_doc(doc: DocWriter, replacement_attributes, shape, resource_t
         doc.add_paragraph(f"""*Update requires*: {update_replace}""", "  ")
 
 
-def shape_args_to_json(shape, resource_type):
+def shape_args_to_json(shape, resource_type, members=None):
     if resource_type:
         prefix = f'{{\n  "Type" : "{resource_type}",\n  "Properties" : {{\n' \
             '    "ServiceToken" : {"Fn::ImportValue": "cfm-reslib"},\n'
@@ -142,12 +138,12 @@ def shape_args_to_json(shape, resource_type):
         indent = "  "
         suffix = '\n}'
 
-    members = ",\n".join(f'{indent}"{n}" : {t}' for n, t in _shape_properties(shape))
+    properties = ",\n".join(f'{indent}"{n}" : {t}' for n, t in _shape_properties(shape, members))
 
-    return prefix + members + suffix
+    return prefix + properties + suffix
 
 
-def shape_args_to_yaml(shape, resource_type):
+def shape_args_to_yaml(shape, resource_type, members=None):
     if resource_type:
         result = f'Type: {resource_type}\nProperties :\n  ServiceToken : !ImportValue cfm-reslib\n'
         indent = "  "
@@ -156,7 +152,7 @@ def shape_args_to_yaml(shape, resource_type):
         indent = ""
 
     # TODO something not based on the string result of _shape_properties?
-    for n, t in _shape_properties(shape):
+    for n, t in _shape_properties(shape, members):
         result += f"{indent}{n} :"
         if t.startswith("["):
             result += f"\n{indent}  - {t.strip('[] .,')}\n"
@@ -168,17 +164,32 @@ def shape_args_to_yaml(shape, resource_type):
     return result
 
 
-def _shape_properties(shape):
+def _classify_members(shape):
+    """
+    Returns a list of (member name, member shape, element shape, is list) for every member of the structure shape. The
+    element shape is the shape of list items for lists and the member shape itself for anything else.
+    """
     assert shape.type_name == "structure"
 
+    members = []
     for member_name, member_shape in shape.members.items():
+        if member_shape.type_name == "list":
+            members.append((member_name, member_shape, member_shape.member, True))
+        else:
+            members.append((member_name, member_shape, member_shape, False))
+    return members
+
+
+def _shape_properties(shape, members=None):
+    if members is None:
+        members = _classify_members(shape)
+
+    for member_name, _, element_shape, is_list in members:
         linked_name = f":ref:`member_{shape.name}_{member_name}`"
-        if member_shape.type_name == "structure":
-            yield linked_name, f":ref:`type_{member_shape.name}`"
-        elif member_shape.type_name == "list":
-            if member_shape.member.type_name == "structure":
-                yield linked_name, f"[ :ref:`type_{member_shape.member.name}`, ... ]"
-            else:
-                yield linked_name, f"[ {member_shape.member.type_name}, ... ]"
+        if element_shape.type_name == "structure":
+            type_name = f":ref:`type_{element_shape.name}`"
         else:
-            yield linked_name, member_shape.type_name
+            type_name = element_shape.type_name
+        if is_list:
+            type_name = f"[ {type_name}, ... ]"
+        yield linked_name, type_name
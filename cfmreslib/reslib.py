@@ -14,10 +14,10 @@ def handler(event, context):
     print("event:", event)
 
     try:
-        for resource in ALL_RESOURCES:
-            if event["ResourceType"] == "Custom::" + resource.NAME:
-                resource().handle(event, context)
-                break
+        prefix, _, name = event["ResourceType"].partition("::")
+        resource = ALL_RESOURCES.get(name) if prefix == "Custom" else None
+        if resource:
+            resource().handle(event, context)
         else:
             status = FAILED
             if event["RequestType"] == "Delete" and event["PhysicalResourceId"] == UNABLE_TO_CREATE:
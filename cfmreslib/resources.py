@@ -1,12 +1,25 @@
 import collections
+import concurrent.futures
+import copy
+import functools
+import itertools
+import random
 import time
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Type
 
+import botocore.config
 from botocore.model import DenormalizedStructureBuilder
+from botocore.utils import CachedProperty
 
-from cfmreslib.base import AWS_SESSION, CustomResourceHandler
+from cfmreslib.base import CustomResourceHandler, get_client
 from cfmreslib.boto import BotoResourceHandler
 
+# how long to wait for ACM validation records inside one request before leaving the waiting to the waiter state machine
+VALIDATION_RECORDS_TIMEOUT = 20
+# ACM calls are small, so fail fast instead of spending the Lambda timeout on retrying a stuck connection
+_ACM_CONFIG = botocore.config.Config(retries={"max_attempts": 2, "mode": "standard"}, connect_timeout=3,
+                                     read_timeout=10)
+
 
 class ElasticTranscoderPipeline(BotoResourceHandler):
     NAME = "ElasticTranscoderPipeline"
@@ -62,6 +75,9 @@ class KafkaCluster(BotoResourceHandler):
         "expected_value": "ACTIVE",
         "failed_values": ["DELETING", "FAILED"],
     }
+    CREATE_READY_QUERY = {
+        "query": "State",
+    }
     DELETE_METHOD = {
         "name": "delete_cluster",
         "physical_id_argument": "ClusterArn",
@@ -85,16 +101,18 @@ class Route53Certificate(CustomResourceHandler):
 
     def __init__(self):
         super().__init__()
-        self._acm_client = AWS_SESSION.client("acm")
-        self._route53_client = AWS_SESSION.client("route53")
+        self._acm_client = get_client("acm", _ACM_CONFIG)
+        self._route53_client = get_client("route53")
+        self._description = None
 
-    @property
+    @CachedProperty
     def input_shape(self):
-        # TODO make a copy of the shape somehow
-        shape = self._acm_client.meta.service_model.operation_model("RequestCertificate").input_shape
-        for m in set(shape.members.keys()):
-            if m not in ["DomainName", "SubjectAlternativeNames"]:
-                del shape.members[m]
+        # the client is shared, so trim a copy and leave the shape it validates requests with alone
+        request_shape = self._acm_client.meta.service_model.operation_model("RequestCertificate").input_shape
+        shape = copy.copy(request_shape)
+        shape.members = collections.OrderedDict(
+            (m, member) for m, member in request_shape.members.items() if m in ["DomainName", "SubjectAlternativeNames"]
+        )
         return shape
 
     def create(self, args: Dict[str, object]) -> None:
@@ -107,104 +125,157 @@ class Route53Certificate(CustomResourceHandler):
         )
         self.physical_id = response["CertificateArn"]
 
-        self._wait_for_validation_resources()
-        self._update_route53("UPSERT")
-        self._wait_ready()
+        self._validate(VALIDATION_RECORDS_TIMEOUT)
+
+    def _validate(self, timeout):
+        if self._wait_for_validation_resources(timeout):
+            self._update_route53("UPSERT")
+            self._wait_ready()
+        else:
+            print("Validation records not ready yet, waiting...")
+            self._wait("WaitValidation")
+
+    def __handle_wait_validation(self):
+        # the waiter already waited, so check just once before waiting again
+        self._validate(0)
+
+    _REQUEST_HANDLERS = dict(CustomResourceHandler._REQUEST_HANDLERS, WaitValidation=__handle_wait_validation)
 
-    def _wait_for_validation_resources(self):
-        while True:
-            desc = self._acm_client.describe_certificate(CertificateArn=self.physical_id)
+    def _wait_for_validation_resources(self, timeout) -> bool:
+        deadline = time.monotonic() + timeout
+        for attempt in itertools.count():
+            self._description = None  # always poll, the records are what we're waiting for
+            desc = self._describe()
 
             # check status
             status = desc["Certificate"]["Status"]
             if status == "ISSUED":
-                return
+                return True
             if status != "PENDING_VALIDATION":
                 failure_reason = desc["Certificate"].get("FailureReason", "Unknown")
                 raise RuntimeError(f"Certificate status is {status}: {failure_reason}")
 
             # check that all domains have resource record request
-            for validation in desc["Certificate"]["DomainValidationOptions"]:
-                if "ResourceRecord" not in validation:
-                    break
-            else:
-                # no validation request is empty
-                return
-
-            time.sleep(10)
+            if all("ResourceRecord" in validation for validation in desc["Certificate"]["DomainValidationOptions"]):
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            # records usually show up within seconds, so poll quickly at first and back off to every 10 seconds
+            delay = min(0.5 * 2 ** attempt, 10) * random.uniform(0.5, 1)
+            time.sleep(min(delay, remaining))
+
+    @CachedProperty
+    def _hosted_zones(self) -> Dict[str, str]:
+        # delete() updates records twice, listing every zone in the account once is enough
+        # keyed by the zone name without the trailing dot so names can be looked up directly
+        zones = self._route53_client.get_paginator("list_hosted_zones").paginate().build_full_result()
+        return {zone["Name"].strip(".").lower(): zone["Id"] for zone in zones["HostedZones"]}
+
+    def _find_hosted_zone(self, name: str) -> Optional[str]:
+        # try the name itself and then every parent domain, so the most specific zone wins
+        labels = name.strip(".").lower().split(".")
+        for i in range(len(labels)):
+            zone_id = self._hosted_zones.get(".".join(labels[i:]))
+            if zone_id:
+                return zone_id
+        return None
 
     def _get_domains(self) -> Dict[str, Dict[str, str]]:
         cnames = {}
-        desc = self._acm_client.describe_certificate(CertificateArn=self.physical_id)
+        desc = self._describe()
         for validation in desc["Certificate"]["DomainValidationOptions"]:
             if "ResourceRecord" in validation:
                 cnames[validation["ResourceRecord"]["Name"]] = validation["ResourceRecord"]["Value"]
 
-        hosted_zones = {}
-        for zone_set in self._route53_client.get_paginator("list_hosted_zones").paginate():
-            for zone in zone_set["HostedZones"]:
-                hosted_zones[zone["Name"]] = zone["Id"]
-
-        result = collections.defaultdict(dict)
+        result: Dict[str, Dict[str, str]] = {}
         for cname, value in cnames.items():
-            for zone, zone_id in hosted_zones.items():
-                cleared_zone = zone.strip(".")
-                cleared_cname = cname.strip(".")
-                if cleared_cname == cleared_zone or cleared_cname.endswith(f".{cleared_zone}"):
-                    result[zone_id][cname] = value
-                    break
-            else:
+            zone_id = self._find_hosted_zone(cname)
+            if not zone_id:
                 raise RuntimeError(f"Unable to find hosted zone for {cname}, is it hosted on Route 53?")
+            result.setdefault(zone_id, {})[cname] = value
 
         return result
 
     def _update_route53(self, action):
-        for zone_id, cnames in self._get_domains().items():
-            self._route53_client.change_resource_record_sets(
-                HostedZoneId=zone_id,
-                ChangeBatch={
-                    "Comment": f"Validation records for {self.physical_id} by CloudFormation",
-                    "Changes": [
-                        {
-                            "Action": action,
-                            "ResourceRecordSet": {
-                                "Name": cname,
-                                "Type": "CNAME",
-                                "TTL": 3600,
-                                "ResourceRecords": [
-                                    {
-                                        "Value": value,
-                                    },
-                                ]
-                            }
+        domains = self._get_domains()
+        if not domains:
+            return
+
+        # one change batch per hosted zone and zones are independent, so send them concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(domains))) as executor:
+            changes = [
+                executor.submit(self._change_zone_records, zone_id, cnames, action)
+                for zone_id, cnames in domains.items()
+            ]
+
+        for change in changes:
+            change.result()
+
+    def _change_zone_records(self, zone_id, cnames, action):
+        self._route53_client.change_resource_record_sets(
+            HostedZoneId=zone_id,
+            ChangeBatch={
+                "Comment": f"Validation records for {self.physical_id} by CloudFormation",
+                "Changes": [
+                    {
+                        "Action": action,
+                        "ResourceRecordSet": {
+                            "Name": cname,
+                            "Type": "CNAME",
+                            "TTL": 3600,
+                            "ResourceRecords": [
+                                {
+                                    "Value": value,
+                                },
+                            ]
                         }
-                        for cname, value in cnames.items()
-                    ]
-                }
-            )
+                    }
+                    for cname, value in cnames.items()
+                ]
+            }
+        )
 
     def can_update(self, old_args: Dict[str, object], new_args: Dict[str, object], diff: List[str]) -> bool:
         return False
 
     def delete(self) -> None:
-        self._update_route53("UPSERT")  # can't delete something that's not there
-        self._update_route53("DELETE")
+        try:
+            self._update_route53("DELETE")
+        except self._route53_client.exceptions.InvalidChangeBatch as e:
+            message = e.response["Error"].get("Message", "")
+            if "not found" not in message and "does not exist" not in message:
+                raise
+            # can't delete something that's not there, so put any missing records back and delete them all
+            self._update_route53("UPSERT")
+            self._update_route53("DELETE")
         self._acm_client.delete_certificate(CertificateArn=self.physical_id)
+        self._description = None
         self._success(None)
 
     def data(self) -> Optional[Dict[str, object]]:
         return None
 
+    def _describe(self):
+        # exists(), ready() and both record updates in delete() need the same call, so its response is kept until the
+        # certificate is modified
+        if self._description is None or self._description[0] != self.physical_id:
+            response = self._acm_client.describe_certificate(CertificateArn=self.physical_id)
+            self._description = (self.physical_id, response)
+
+        return self._description[1]
+
     def exists(self) -> bool:
         try:
-            self._acm_client.describe_certificate(CertificateArn=self.physical_id)
+            self._describe()
             return True
         except self._acm_client.exceptions.ResourceNotFoundException:
             return False
 
     def ready(self) -> bool:
-        desc = self._acm_client.describe_certificate(CertificateArn=self.physical_id)
-        status = desc["Certificate"]["Status"]
+        status = self._describe()["Certificate"]["Status"]
         if status == "ISSUED":
             return True
 
@@ -224,6 +295,25 @@ class Route53Certificate(CustomResourceHandler):
         ]
 
 
+@functools.lru_cache(maxsize=None)
+def _find_ami_input_shape():
+    # doesn't depend on the handler instance, so it's built once for all of them
+    return DenormalizedStructureBuilder().with_members({
+        "Owner": {
+            "type": "string",
+            "documentation": "Image owner (e.g. \"679593333241\" for CentOS)",
+        },
+        "Name": {
+            "type": "string",
+            "documentation": "Image name (e.g. \"CentOS Linux 7 x86_64 HVM EBS *\")",
+        },
+        "Architecture": {
+            "type": "string",
+            "documentation": "Image architecture (e.g. \"x86_64\")",
+        },
+    }).build_model()
+
+
 class FindAMI(CustomResourceHandler):
     NAME = "FindAMI"
     DESCRIPTION = "The ``Custom::FindAMI`` resource finds an AMI by owner, name and architecture. The result can then" \
@@ -258,24 +348,11 @@ class FindAMI(CustomResourceHandler):
 
     def __init__(self):
         super().__init__()
-        self._ec2_client = AWS_SESSION.client("ec2")
+        self._ec2_client = get_client("ec2")
 
     @property
     def input_shape(self):
-        return DenormalizedStructureBuilder().with_members({
-            "Owner": {
-                "type": "string",
-                "documentation": "Image owner (e.g. \"679593333241\" for CentOS)",
-            },
-            "Name": {
-                "type": "string",
-                "documentation": "Image name (e.g. \"CentOS Linux 7 x86_64 HVM EBS *\")",
-            },
-            "Architecture": {
-                "type": "string",
-                "documentation": "Image architecture (e.g. \"x86_64\")",
-            },
-        }).build_model()
+        return _find_ami_input_shape()
 
     def create(self, args: Dict[str, object]) -> None:
         response = self._ec2_client.describe_images(
@@ -287,12 +364,11 @@ class FindAMI(CustomResourceHandler):
             ],
         )
 
-        ami_list = sorted(response['Images'], key=lambda x: x['CreationDate'], reverse=True)
-
-        if not ami_list:
+        if not response['Images']:
             raise RuntimeError("No images found")
 
-        self.physical_id = ami_list[0]['ImageId']
+        # only the newest image is needed, no need to sort all of them
+        self.physical_id = max(response['Images'], key=lambda x: x['CreationDate'])['ImageId']
         self._success(None)
 
     def can_update(self, old_args: Dict[str, object], new_args: Dict[str, object], diff: List[str]) -> bool:
@@ -313,4 +389,7 @@ class FindAMI(CustomResourceHandler):
         ]
 
 
-ALL_RESOURCES = [ElasticTranscoderPipeline, KafkaCluster, Route53Certificate, FindAMI]
+#: all available resources by their name, without the ``Custom::`` prefix
+ALL_RESOURCES: Dict[str, Type[CustomResourceHandler]] = {
+    resource.NAME: resource for resource in [ElasticTranscoderPipeline, KafkaCluster, Route53Certificate, FindAMI]
+}
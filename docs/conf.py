@@ -99,7 +99,7 @@ def build_inited_handler(app):
     with open(os.path.join(base, "index.rst"), "w") as index:
         index.write(INDEX)
 
-    for res in cfmreslib.resources.ALL_RESOURCES:
+    for res in cfmreslib.resources.ALL_RESOURCES.values():
         with cfmreslib.docs.DocWriter(base, f"res_{res.NAME}") as doc:
             res.write_docs(doc)
 
@@ -0,0 +1,78 @@
+import unittest
+
+from cfmreslib.base import CustomResourceHandler, _diff_attributes
+
+
+class RecordingHandler(CustomResourceHandler):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def _success(self, data):
+        self.calls.append(("success", data))
+
+    def _fail(self, reason):
+        self.calls.append(("fail", reason))
+
+    def exists(self):
+        return True
+
+    def ready(self):
+        return True
+
+    def data(self):
+        return {"Ready": True}
+
+    def create(self, args):
+        self.calls.append(("create", args))
+
+    def delete(self):
+        self.calls.append(("delete", None))
+
+    def can_update(self, old_args, new_args, diff):
+        return "Replace" not in diff
+
+    def update(self, old_args, new_args, diff):
+        self.calls.append(("update", diff))
+
+
+class TestDiffAttributes(unittest.TestCase):
+    def test_diff(self):
+        old = {"Same": "1", "Changed": "1", "Removed": "1", "Nested": {"A": "1"}}
+        new = {"Same": "1", "Changed": "2", "Added": "1", "Nested": {"A": "2"}}
+
+        assert sorted(_diff_attributes(old, new)) == ["Added", "Changed", "Nested", "Removed"]
+
+    def test_no_diff(self):
+        props = {"A": "1", "B": ["1", "2"]}
+
+        assert list(_diff_attributes(props, dict(props))) == []
+        assert list(_diff_attributes({}, {})) == []
+
+    def test_none_value(self):
+        assert list(_diff_attributes({}, {"A": None})) == ["A"]
+        assert list(_diff_attributes({"A": None}, {})) == ["A"]
+
+
+class TestHandle(unittest.TestCase):
+    def _handle(self, request_type, old_properties=None):
+        handler = RecordingHandler()
+        handler.handle({
+            "RequestType": request_type,
+            "PhysicalResourceId": "id",
+            "ResourceProperties": {"ServiceToken": "token", "A": "1"},
+            "OldResourceProperties": dict(old_properties or {}, ServiceToken="token"),
+        }, None)
+        return handler.calls
+
+    def test_dispatch(self):
+        assert self._handle("Create") == [("create", {"A": "1"})]
+        assert self._handle("Delete") == [("delete", None)]
+        assert self._handle("WaitReady") == [("success", {"Ready": True})]
+
+    def test_invalid_request_type(self):
+        assert self._handle("Bad") == [("fail", "Invalid request type Bad")]
+
+    def test_update(self):
+        assert self._handle("Update", {"A": "2"}) == [("update", ["A"])]
+        assert self._handle("Update", {"A": "1", "Replace": "1"}) == [("create", {"A": "1"})]
@@ -44,6 +44,10 @@ class TestBotoMethod(unittest.TestCase):
         assert method._get_arg_type(["BrokerNodeGroupInfo", "DoesNotExistForSure"], "Something") == ""
         assert method._get_arg_type(["BrokerNodeGroupInfo", "DoesNotExistForSure", "Hello"], "Something") == ""
 
+    def test_needs_coercion(self):
+        assert BotoMethod("kafka", {"name": "create_cluster"})._needs_coercion
+        assert not BotoMethod("kafka", {"name": "describe_cluster"})._needs_coercion
+
     def test_coerce_args(self):
         method = BotoMethod("kafka", {"name": "create_cluster"})
 
@@ -79,3 +83,38 @@ class TestBotoMethod(unittest.TestCase):
             "NumberOfBrokerNodes": "not a number",
         }
         assert dict(method._coerce_args(args)) == args
+
+    def test_coerce_bool_args(self):
+        method = BotoMethod("kafka", {"name": "create_cluster"})
+
+        args = {
+            "EncryptionInfo": {
+                "EncryptionInTransit": {
+                    "InCluster": "false",
+                },
+            },
+            "ClientAuthentication": {
+                "Tls": {
+                    "Enabled": "True",
+                },
+                "Unauthenticated": {
+                    "Enabled": "not a boolean",
+                },
+            },
+        }
+        expected = {
+            "EncryptionInfo": {
+                "EncryptionInTransit": {
+                    "InCluster": False,
+                },
+            },
+            "ClientAuthentication": {
+                "Tls": {
+                    "Enabled": True,
+                },
+                "Unauthenticated": {
+                    "Enabled": "not a boolean",
+                },
+            },
+        }
+        assert dict(method._coerce_args(args)) == expected
@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+from botocore.model import ShapeResolver
+
+from cfmreslib import docs
+
+
+class TestShapeArgsToDoc(unittest.TestCase):
+    def test_recursive_shape(self):
+        resolver = ShapeResolver({
+            "Node": {
+                "type": "structure",
+                "members": {
+                    "Name": {"shape": "String"},
+                    "Child": {"shape": "Node"},
+                    "Children": {"shape": "NodeList"},
+                },
+            },
+            "NodeList": {"type": "list", "member": {"shape": "Node"}},
+            "String": {"type": "string"},
+        })
+
+        with tempfile.TemporaryDirectory() as base_path:
+            with docs.DocWriter(base_path, "res_Test") as doc:
+                docs.shape_args_to_doc(doc, "Custom::Test", resolver.get_shape_by_name("Node"), set())
+
+            assert sorted(os.listdir(base_path)) == ["res_Test.rst", "type_Node.rst"]
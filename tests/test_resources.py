@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+
+from cfmreslib.base import get_client
+from cfmreslib.resources import Route53Certificate
+
+
+class FakeRoute53(object):
+    exceptions = get_client("route53").exceptions
+
+    def __init__(self, zones, existing_records=()):
+        self.zones = zones
+        self.records = set(existing_records)
+        self.calls = []
+        self.error = None  # message of an error to fail all changes with
+
+    def get_paginator(self, name):
+        assert name == "list_hosted_zones"
+        return self
+
+    def paginate(self):
+        return self
+
+    def build_full_result(self):
+        return {"HostedZones": [{"Name": name, "Id": zone_id} for name, zone_id in self.zones.items()]}
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        action = ChangeBatch["Changes"][0]["Action"]
+        names = {change["ResourceRecordSet"]["Name"] for change in ChangeBatch["Changes"]}
+        self.calls.append(action)
+        if self.error:
+            self._raise(self.error)
+        if action == "UPSERT":
+            self.records |= names
+        elif not names <= self.records:
+            self._raise(f"Tried to delete resource record set {sorted(names - self.records)} but it was not found")
+        else:
+            self.records -= names
+
+
+    def _raise(self, message):
+        error = {"Error": {"Code": "InvalidChangeBatch", "Message": message}}
+        raise self.exceptions.InvalidChangeBatch(error, "ChangeResourceRecordSets")
+
+
+class FakeACM(object):
+    def __init__(self, records):
+        self.records = records  # records without a value are still pending in ACM
+
+    def request_certificate(self, **kwargs):
+        return {"CertificateArn": "arn:certificate"}
+
+    def delete_certificate(self, CertificateArn):
+        pass
+
+    def describe_certificate(self, CertificateArn):
+        return {
+            "Certificate": {
+                "Status": "PENDING_VALIDATION",
+                "DomainValidationOptions": [
+                    {"ResourceRecord": {"Name": n, "Value": v}} if v else {} for n, v in self.records
+                ],
+            }
+        }
+
+
+class TestRoute53Certificate(unittest.TestCase):
+    def _certificate(self, zones, records, existing_records=()):
+        certificate = Route53Certificate()
+        certificate.physical_id = "arn:certificate"
+        certificate._success = lambda data: None
+        certificate._fail = lambda reason: self.fail(reason)
+        certificate.waits = []
+        certificate._wait = certificate.waits.append
+        certificate._route53_client = FakeRoute53(zones, existing_records)
+        certificate._acm_client = FakeACM(records)
+        return certificate
+
+    def test_get_domains(self):
+        certificate = self._certificate(
+            {"example.com.": "Z1", "sub.example.com.": "Z2"},
+            [("_a.Example.com.", "1"), ("_b.deep.sub.example.com.", "2"), ("_c.sub.example.com.", "3")],
+        )
+
+        assert certificate._get_domains() == {
+            "Z1": {"_a.Example.com.": "1"},
+            "Z2": {"_b.deep.sub.example.com.": "2", "_c.sub.example.com.": "3"},
+        }
+
+    def test_get_domains_missing_zone(self):
+        certificate = self._certificate({"example.com.": "Z1"}, [("_a.notexample.com.", "1")])
+
+        with self.assertRaises(RuntimeError):
+            certificate._get_domains()
+
+    def test_delete(self):
+        certificate = self._certificate({"example.com.": "Z1"}, [("_a.example.com.", "1")], ["_a.example.com."])
+        certificate.delete()
+
+        assert certificate._route53_client.calls == ["DELETE"]
+
+    def test_delete_missing_records(self):
+        certificate = self._certificate({"example.com.": "Z1"}, [("_a.example.com.", "1")])
+        certificate.delete()
+
+        assert certificate._route53_client.calls == ["DELETE", "UPSERT", "DELETE"]
+        assert not certificate._route53_client.records
+
+    def test_delete_invalid_change(self):
+        certificate = self._certificate({"example.com.": "Z1"}, [("_a.example.com.", "1")], ["_a.example.com."])
+        certificate._route53_client.error = "RRSet of type CNAME with DNS name _a.example.com. is not permitted"
+
+        with self.assertRaises(certificate._route53_client.exceptions.InvalidChangeBatch):
+            certificate.delete()
+
+        assert certificate._route53_client.calls == ["DELETE"]
+
+    def test_create_waits_for_validation_records(self):
+        certificate = self._certificate({"example.com.": "Z1"}, [("_a.example.com.", None)])
+
+        with mock.patch("cfmreslib.resources.VALIDATION_RECORDS_TIMEOUT", 0):
+            certificate.create({"DomainName": "example.com"})
+
+        assert certificate.waits == ["WaitValidation"]
+        assert not certificate._route53_client.calls
+
+        certificate._acm_client.records = [("_a.example.com.", "1")]
+        certificate.handle({"RequestType": "WaitValidation", "PhysicalResourceId": "arn:certificate"}, None)
+
+        assert certificate.waits == ["WaitValidation", "WaitReady"]
+        assert certificate._route53_client.calls == ["UPSERT"]